@@ -1,24 +1,30 @@
-from typing import Union, List, Dict, Any
+from typing import Union, List, Dict, Any, Tuple, Optional, Iterator
 import logging
+from collections import OrderedDict
 from datetime import datetime
-from glob import glob
+from contextlib import contextmanager
+from functools import cached_property, lru_cache
 from os import makedirs
 from os.path import exists, join, abspath, expanduser, basename, splitext
 import json
 import h5py
 import numpy as np
-import pandas as pd
+import shapely
+from pyproj import Transformer
 from dateutil import parser
 from matplotlib.colors import LinearSegmentedColormap
 from shapely.geometry import Point, Polygon
-from skimage.transform import resize
+
+try:
+    import numexpr as ne
+except ImportError:
+    ne = None
 
 import colored_logging
 import rasters
-import rasters as rt
 from modland import parsehv, generate_modland_grid
 
-from rasters import Raster, RasterGrid, RasterGeometry
+from rasters import Raster, RasterGrid, RasterGeometry, BBox, OutOfBoundsError
 
 from .granule_ID import *
 
@@ -39,8 +45,29 @@ ALBEDO_COLORMAP = "gray"
 
 DEFAULT_WORKING_DIRECTORY = "."
 
+# HDF5 chunk cache settings for the datasets of a granule. HDF5 keeps a chunk
+# cache per open dataset, so while a granule is used as a context manager the
+# most recently read datasets are held open to keep decompressed chunks between
+# reads of the same variable. Each held dataset can pin up to
+# HDF5_CHUNK_CACHE_BYTES of decompressed chunks, so at most
+# HDF5_MAX_OPEN_DATASETS are held per granule; reading further variables closes
+# the least recently used dataset and frees its cache.
+HDF5_CHUNK_CACHE_BYTES = 64 * 1024 * 1024
+HDF5_CHUNK_CACHE_SLOTS = 1009
+HDF5_CHUNK_CACHE_W0 = 0.75
+HDF5_MAX_OPEN_DATASETS = 2
+
 logger = logging.getLogger(__name__)
 
+@lru_cache(maxsize=1024)
+def _parse_tile_hv(tile: str) -> Tuple[int, int]:
+    """
+    Return the horizontal and vertical indices of a MODLAND tile, memoized across granules.
+
+    :param tile: The tile identifier, e.g. "h08v05".
+    """
+    return parsehv(tile)
+
 class VIIRSTiledGranule:
     """
     Class representing a VIIRS Granule.
@@ -54,11 +81,43 @@ class VIIRSTiledGranule:
         """
         self._filename = filename
         self._cloud_mask = None
+        self._file = None
+        self._context_depth = 0
+        self._datasets: OrderedDict[Tuple[str, str], h5py.Dataset] = OrderedDict()
+        self._attr_cache: Dict[Tuple[str, str], Dict] = {}
+
+    def __enter__(self):
+        # hold the HDF5 file open for the duration of the with block
+        if self._file is None:
+            self._file = self._open_file()
+
+        self._context_depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._context_depth -= 1
+
+        if self._context_depth == 0:
+            self.close()
+
+    def __getstate__(self):
+        # open HDF5 file handles cannot be pickled
+        state = self.__dict__.copy()
+        state["_file"] = None
+        state["_context_depth"] = 0
+        state["_datasets"] = OrderedDict()
+        return state
 
     def __repr__(self):
         """
         Return a string representation of the VIIRSGranule object.
         """
+        return f"VIIRSTiledGranule(filename={self.filename!r})"
+
+    def to_json(self) -> str:
+        """
+        Return a JSON representation of the VIIRSGranule object.
+        """
         display_dict = {
             "filename": self.filename
         }
@@ -72,68 +131,132 @@ class VIIRSTiledGranule:
         """
         return self._filename
     
-    @property
+    def _open_file(self) -> h5py.File:
+        """
+        Open the HDF5 file of the granule with the granule chunk cache settings.
+        """
+        return h5py.File(
+            self.filename_absolute,
+            "r",
+            rdcc_nbytes=HDF5_CHUNK_CACHE_BYTES,
+            rdcc_nslots=HDF5_CHUNK_CACHE_SLOTS,
+            rdcc_w0=HDF5_CHUNK_CACHE_W0
+        )
+
+    @contextmanager
+    def _file_handle(self) -> Iterator[h5py.File]:
+        """
+        Yield the HDF5 file of the granule.
+
+        Inside a with block on the granule the file held open by the block is reused,
+        otherwise the file is opened for this call only and closed afterwards.
+        """
+        if self._file is not None:
+            yield self._file
+        else:
+            with self._open_file() as file:
+                yield file
+
+    def close(self):
+        """
+        Close the HDF5 file handle of the granule if it is open.
+        """
+        self._datasets.clear()
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _dataset(self, file: h5py.File, variable: str, grid: str) -> h5py.Dataset:
+        """
+        Return the HDF5 dataset of a variable.
+
+        The most recently read datasets of the file held open by a with block are
+        kept open so their chunk cache persists.
+
+        :param file: The open HDF5 file of the granule.
+        :param variable: The variable name.
+        :param grid: The grid name.
+        """
+        dataset_name = f"HDFEOS/GRIDS/{grid}/Data Fields/{variable}"
+
+        if file is not self._file:
+            return file[dataset_name]
+
+        if (variable, grid) in self._datasets:
+            self._datasets.move_to_end((variable, grid))
+        else:
+            self._datasets[(variable, grid)] = file[dataset_name]
+
+            # release the least recently read datasets and their chunk caches
+            while len(self._datasets) > HDF5_MAX_OPEN_DATASETS:
+                self._datasets.popitem(last=False)
+
+        return self._datasets[(variable, grid)]
+
+    @cached_property
     def filename_absolute(self) -> str:
         """
         Return the absolute path of the filename.
         """
         return abspath(expanduser(self.filename))
 
-    @property
+    @cached_property
     def filename_base(self) -> str:
         """
         Return the base name of the filename.
         """
         return basename(self.filename)
 
-    @property
+    @cached_property
     def filename_stem(self) -> str:
         """
         Return the stem of the filename.
         """
         return splitext(self.filename_base)[0]
 
-    @property
+    @cached_property
     def tile(self) -> str:
         """
         Return the tile information from the filename.
         """
         return parse_VIIRS_tile(self.filename)
 
-    @property
+    @cached_property
     def hv(self) -> tuple:
         """
         Return the horizontal and vertical tile indices.
         """
-        return parsehv(self.tile)
+        return _parse_tile_hv(self.tile)
 
-    @property
+    @cached_property
     def h(self) -> int:
         """
         Return the horizontal tile index.
         """
         return self.hv[0]
 
-    @property
+    @cached_property
     def v(self) -> int:
         """
         Return the vertical tile index.
         """
         return self.hv[1]
 
-    @property
+    @cached_property
     def date_UTC(self) -> datetime:
         """
         Return the date in UTC from the filename.
         """
-        return datetime.strptime(self.filename_base.split(".")[1][1:], "%Y%j")
+        date_UTC = parse_VIIRS_date(self.filename_base)
+        return datetime(date_UTC.year, date_UTC.month, date_UTC.day)
 
     @property
     def grids(self) -> List[str]:
         """
         Return the list of grids in the HDF5 file.
         """
-        with h5py.File(self.filename_absolute, "r") as file:
+        with self._file_handle() as file:
             return list(file["HDFEOS/GRIDS/"].keys())
 
     def variables(self, grid: str) -> List[str]:
@@ -142,31 +265,257 @@ class VIIRSTiledGranule:
 
         :param grid: The grid name.
         """
-        with h5py.File(self.filename_absolute, "r") as file:
+        with self._file_handle() as file:
             return list(file[f"HDFEOS/GRIDS/{grid}/Data Fields/"].keys())
         
-    def DN(self, variable: str, grid: str, geometry: RasterGeometry = None) -> Raster:
-        with h5py.File(self.filename_absolute, "r") as file:
-            dataset_name = f"HDFEOS/GRIDS/{grid}/Data Fields/{variable}"
-            dataset = file[dataset_name]
+    @staticmethod
+    def _footprint(geometry: RasterGeometry, crs) -> Optional[BBox]:
+        """
+        Return the bounding box of a raster geometry projected to another CRS.
+
+        Meridians are curved in the sinusoidal projection, so the extent of a
+        reprojected target can peak between its corners, e.g. at the equator.
+        The outline of the target is densified before it is projected so that
+        its full extent is covered.
+
+        :param geometry: The target geometry.
+        :param crs: The CRS to project the footprint to.
+        :return: The projected bounding box, or None if it cannot be determined.
+        """
+        if isinstance(geometry, RasterGrid):
+            # sample the outer edges of the grid at the spacing of its cells
+            outline = shapely.segmentize(
+                geometry.corner_polygon.geometry,
+                max_segment_length=min(abs(geometry.cell_width), abs(geometry.cell_height))
+            )
+            x, y = shapely.get_coordinates(outline).T
+        elif isinstance(geometry, RasterGeometry):
+            # sample the centers of every pixel along the edge of the geolocation arrays
+            x, y = shapely.get_coordinates(geometry.boundary.geometry).T
+        else:
+            return None
+
+        transformer = Transformer.from_crs(geometry.crs, crs, always_xy=True)
+        x, y = transformer.transform(x, y)
+
+        if len(x) == 0 or not (np.all(np.isfinite(x)) and np.all(np.isfinite(y))):
+            return None
+
+        return BBox(np.min(x), np.min(y), np.max(x), np.max(y), crs=crs)
+
+    @staticmethod
+    def _window(
+            dataset: h5py.Dataset,
+            DN_geometry: RasterGrid,
+            geometry: RasterGeometry = None) -> Tuple[slice, slice]:
+        """
+        Return the row and column slices of the tile needed to cover the target geometry.
+
+        Targets in another CRS are windowed by their densified, projected outline.
+        The window is padded by one pixel for resampling and rounded outward to
+        the dataset's chunk boundaries so that only whole chunks are read.
+
+        :param dataset: The HDF5 dataset being read.
+        :param DN_geometry: The MODLAND grid of the full tile.
+        :param geometry: The target geometry, or None to read the full tile.
+        """
+        rows, cols = dataset.shape[:2]
+        full_window = (slice(0, rows), slice(0, cols))
+
+        if geometry is None:
+            return full_window
+
+        footprint = geometry
+
+        if isinstance(geometry, RasterGeometry) and geometry.crs != DN_geometry.crs:
+            footprint = VIIRSTiledGranule._footprint(geometry, DN_geometry.crs)
+
+            # read the full tile rather than risk clipping pixels the target needs
+            if footprint is None:
+                return full_window
+
+        try:
+            window = DN_geometry.window(footprint, buffer=1)
+        except OutOfBoundsError:
+            return full_window
+
+        row_start = int(window.row_off)
+        row_stop = row_start + int(window.height)
+        col_start = int(window.col_off)
+        col_stop = col_start + int(window.width)
+
+        if row_stop <= row_start or col_stop <= col_start:
+            return full_window
+
+        if dataset.chunks is not None:
+            chunk_rows, chunk_cols = dataset.chunks[:2]
+            row_start = row_start // chunk_rows * chunk_rows
+            row_stop = min(-(-row_stop // chunk_rows) * chunk_rows, rows)
+            col_start = col_start // chunk_cols * chunk_cols
+            col_stop = min(-(-col_stop // chunk_cols) * chunk_cols, cols)
+
+        return slice(row_start, row_stop), slice(col_start, col_stop)
+
+    def _read_variable(
+            self,
+            variable: str,
+            grid: str,
+            geometry: RasterGeometry = None) -> Tuple[Raster, Dict]:
+        """
+        Read the DN raster and the attributes of a variable with a single dataset lookup.
+
+        :param variable: The variable name.
+        :param grid: The grid name.
+        :param geometry: The target geometry, or None to read the full tile.
+        """
+        with self._file_handle() as file:
+            dataset = self._dataset(file, variable, grid)
             DN_geometry = generate_modland_grid(tile=self.tile, tile_size=dataset.shape[0])
-            # TODO find a way to only load the pixels needed for the target geometry
-            DN_array = np.array(dataset)
+            row_slice, col_slice = self._window(dataset, DN_geometry, geometry)
+
+            window_shape = (row_slice.stop - row_slice.start, col_slice.stop - col_slice.start)
+
+            # only load the pixels needed for the target geometry
+            if window_shape != dataset.shape[:2]:
+                DN_geometry = DN_geometry[row_slice, col_slice]
+
+            DN_array = np.empty(window_shape, dtype=dataset.dtype)
+            dataset.read_direct(DN_array, source_sel=np.s_[row_slice, col_slice])
             DN = Raster(DN_array, geometry=DN_geometry)
 
+            # granule files are immutable, so attributes are read once per variable
+            if (variable, grid) not in self._attr_cache:
+                self._attr_cache[(variable, grid)] = dict(dataset.attrs.items())
+
+        attributes = self._attr_cache[(variable, grid)]
+
         if geometry is not None:
             DN = DN.to_geometry(geometry)
 
+        return DN, attributes
+
+    def DN(self, variable: str, grid: str, geometry: RasterGeometry = None) -> Raster:
+        DN, _ = self._read_variable(
+            variable=variable,
+            grid=grid,
+            geometry=geometry
+        )
+
         return DN
     
     def attributes(self, variable: str, grid: str) -> Dict:
-        with h5py.File(self.filename_absolute, "r") as file:
-            dataset_name = f"HDFEOS/GRIDS/{grid}/Data Fields/{variable}"
-            dataset = file[dataset_name]
-            attributes = dict(dataset.attrs)
+        if (variable, grid) not in self._attr_cache:
+            with self._file_handle() as file:
+                dataset = self._dataset(file, variable, grid)
+                self._attr_cache[(variable, grid)] = dict(dataset.attrs.items())
+
+        # return a copy so callers cannot change the cached attributes
+        attributes = dict(self._attr_cache[(variable, grid)])
         
         return attributes
     
+    @staticmethod
+    def _scale_DN(
+            DN_array: np.ndarray,
+            fill: int = None,
+            valid_min: int = None,
+            valid_max: int = None,
+            scale: float = None,
+            offset: float = None,
+            dtype: np.dtype = np.float32) -> np.ndarray:
+        """
+        Mask fill and out-of-range pixels of a DN array and apply scale and offset.
+
+        Uses numexpr to evaluate the whole kernel in one blocked, multithreaded pass
+        when it is installed, and falls back to NumPy otherwise.
+
+        :param DN_array: The raw DN array.
+        :param fill: The fill value to mask.
+        :param valid_min: The minimum valid DN.
+        :param valid_max: The maximum valid DN.
+        :param scale: The scale factor to apply.
+        :param offset: The offset to apply after scaling.
+        :param dtype: The floating point type of the output.
+        """
+        if ne is not None:
+            conditions = []
+
+            if fill is not None:
+                conditions.append("(DN == fill)")
+
+            if valid_min is not None:
+                conditions.append("(DN < valid_min)")
+
+            if valid_max is not None:
+                conditions.append("(DN > valid_max)")
+
+            expression = "DN"
+
+            if scale is not None:
+                expression = f"{expression} * scale"
+
+            if offset is not None:
+                expression = f"{expression} + offset"
+
+            if conditions:
+                expression = f"where({' | '.join(conditions)}, nan, {expression})"
+
+            return ne.evaluate(
+                expression,
+                local_dict={
+                    "DN": DN_array,
+                    "fill": fill,
+                    "valid_min": valid_min,
+                    "valid_max": valid_max,
+                    "scale": scale,
+                    "offset": offset,
+                    "nan": np.nan
+                },
+                out=np.empty(DN_array.shape, dtype=dtype),
+                casting="unsafe"
+            )
+
+        # mask invalid pixels against the raw DN, reusing one scratch buffer for each comparison
+        conditions = []
+
+        if fill is not None:
+            conditions.append((np.equal, fill))
+
+        if valid_min is not None:
+            conditions.append((np.less, valid_min))
+
+        if valid_max is not None:
+            conditions.append((np.greater, valid_max))
+
+        invalid = None
+        scratch = None
+
+        for comparison, value in conditions:
+            if invalid is None:
+                invalid = comparison(DN_array, value)
+                continue
+
+            # the scratch buffer is only needed once there is a second condition to combine
+            if scratch is None:
+                scratch = np.empty(DN_array.shape, dtype=bool)
+
+            comparison(DN_array, value, out=scratch)
+            invalid |= scratch
+
+        # apply scale and offset in place on a single floating point copy of the DN
+        layer_array = DN_array.astype(dtype)
+
+        if scale is not None:
+            layer_array *= scale
+
+        if offset is not None:
+            layer_array += offset
+
+        if invalid is not None:
+            layer_array[invalid] = np.nan
+
+        return layer_array
+
     def layer(
             self, 
             variable: str, 
@@ -176,49 +525,61 @@ class VIIRSTiledGranule:
             offset: float = None,
             valid_min: int = None,
             valid_max: int = None,
-            geometry: RasterGeometry = None) -> Raster:
-        DN = self.DN(
-            variable=variable, 
-            grid=grid,
-            geometry=geometry
-        )
+            geometry: RasterGeometry = None,
+            dtype: np.dtype = np.float32) -> Raster:
+        """
+        Return a variable as a scaled raster with fill and out-of-range pixels set to NaN.
 
-        attributes = self.attributes(
+        Scale, offset, fill and valid range default to the dataset attributes.
+        The result is float32, which is precise enough for VIIRS reflectance,
+        NDVI and albedo; pass dtype=np.float64 for double precision.
+
+        :param variable: The variable name.
+        :param grid: The grid name.
+        :param fill: The fill value to mask.
+        :param scale: The scale factor to apply.
+        :param offset: The offset to apply after scaling.
+        :param valid_min: The minimum valid DN.
+        :param valid_max: The maximum valid DN.
+        :param geometry: The target geometry, or None for the full tile.
+        :param dtype: The floating point type of the output.
+        """
+        DN, attributes = self._read_variable(
             variable=variable,
-            grid=grid
+            grid=grid,
+            geometry=geometry
         )
 
-        layer = DN
-
         if fill is None and "_Fillvalue" in attributes:
             fill = int(attributes["_Fillvalue"])
 
-        if fill is not None:
-            layer = rt.where(layer == fill, np.nan, layer)
-
         if valid_min is None and "valid_range" in attributes:
             valid_min = int(attributes["valid_range"][0])
 
-        if valid_min is not None:
-            layer = rt.where(layer < valid_min, np.nan, layer)
-
         if valid_max is None and "valid_range" in attributes:
             valid_max = int(attributes["valid_range"][1])
 
-        if valid_max is not None:
-            layer = rt.where(layer > valid_max, np.nan, layer)
-
         if scale is None and "scale_factor" in attributes:
             scale = float(attributes["scale_factor"])
 
-        if scale is not None:
-            layer *= scale
-        
         if offset is None and "add_offset" in attributes:
             offset = float(attributes["add_offset"])
-        
-        if offset is not None:
-            layer += offset
+
+        layer_array = self._scale_DN(
+            np.asarray(DN),
+            fill=fill,
+            valid_min=valid_min,
+            valid_max=valid_max,
+            scale=scale,
+            offset=offset,
+            dtype=dtype
+        )
+
+        # a point geometry samples a single DN rather than a raster
+        if isinstance(DN, Raster):
+            layer = Raster(layer_array, geometry=DN.geometry)
+        else:
+            layer = layer_array
 
         return layer
 
@@ -228,17 +589,12 @@ class VIIRSTiledGranule:
             grid: str, 
             fill: int = None,
             geometry: RasterGeometry = None) -> Raster:
-        DN = self.DN(
-            variable=variable, 
+        DN, attributes = self._read_variable(
+            variable=variable,
             grid=grid,
             geometry=geometry
         )
 
-        attributes = self.attributes(
-            variable=variable,
-            grid=grid
-        )
-
         layer = DN
 
         if fill is None and "_Fillvalue" in attributes:
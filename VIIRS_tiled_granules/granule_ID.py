@@ -1,5 +1,67 @@
+from typing import NamedTuple
+from calendar import isleap
+from functools import lru_cache
 from os.path import basename
-from datetime import date, datetime
+from datetime import date
+
+class VIIRSFilename(NamedTuple):
+    """
+    Components of a VIIRS granule_ID.
+    """
+    product: str
+    date: date
+    tile: str
+    build: int
+
+@lru_cache(maxsize=4096)
+def _parse_VIIRS_date_token(date_token: str) -> date:
+    """
+    Convert a VIIRS acquisition date token of the form AYYYYDDD to a date object.
+
+    Args:
+        date_token (str): The date token, e.g. "A2023001".
+
+    Returns:
+        date: The date encoded by the year and day of year in the token.
+
+    Raises:
+        ValueError: If the token is not seven digits after its prefix or the day of year is out of range.
+    """
+    digits = date_token[1:]
+
+    if len(digits) != 7 or not digits.isascii() or not digits.isdigit():
+        raise ValueError(f"invalid VIIRS date token: {date_token}")
+
+    year = int(digits[:4])
+    day_of_year = int(digits[4:])
+
+    if not 1 <= day_of_year <= (366 if isleap(year) else 365):
+        raise ValueError(f"invalid day of year in VIIRS date token: {date_token}")
+
+    return date.fromordinal(date(year, 1, 1).toordinal() + day_of_year - 1)
+
+@lru_cache(maxsize=8192)
+def parse_VIIRS_filename(granule_ID: str) -> VIIRSFilename:
+    """
+    Split a VIIRS granule_ID once into its product, date, tile, and build components.
+
+    Use this when more than one component is needed. The single-field parsers
+    only validate the component they return.
+
+    Args:
+        granule_ID (str): The VIIRS granule_ID.
+
+    Returns:
+        VIIRSFilename: The components extracted from the granule_ID.
+    """
+    parts = basename(granule_ID).split(".")
+
+    return VIIRSFilename(
+        product=str(parts[0]),
+        date=_parse_VIIRS_date_token(parts[1]),
+        tile=str(parts[2]),
+        build=int(parts[3])
+    )
 
 def parse_VIIRS_product(granule_ID: str) -> str:
     """
@@ -23,7 +85,7 @@ def parse_VIIRS_date(granule_ID: str) -> date:
     Returns:
         date: The date extracted from the granule_ID.
     """
-    return datetime.strptime(basename(granule_ID).split(".")[1][1:], "%Y%j").date()
+    return _parse_VIIRS_date_token(basename(granule_ID).split(".")[1])
 
 def parse_VIIRS_tile(granule_ID: str) -> str:
     """
@@ -31,9 +31,10 @@ def retrieve_granule(
     granule_ID = remote_granule["meta"]["native-id"]
     
     # Parse the product name, build number, and date from the granule ID
-    product_name = parse_VIIRS_product(granule_ID)
-    build_number = parse_VIIRS_build(granule_ID)
-    date_UTC = parse_VIIRS_date(granule_ID)
+    granule_ID_components = parse_VIIRS_filename(granule_ID)
+    product_name = granule_ID_components.product
+    build_number = granule_ID_components.build
+    date_UTC = granule_ID_components.date
     
     if parent_directory is None:
         # Construct the parent directory path for the download
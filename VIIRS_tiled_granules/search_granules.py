@@ -1,9 +1,11 @@
 from typing import Union, List
-from datetime import datetime, date
+from datetime import datetime, date, timezone
 from dateutil import parser
 import logging
 
 import earthaccess
+import numpy as np
+import shapely
 
 import colored_logging as cl
 from rasters import Point, Polygon, RasterGeometry
@@ -30,8 +32,7 @@ def earliest_datetime(date_in: Union[date, str]) -> datetime:
     else:
         datetime_in = date_in
 
-    date_string = datetime_in.strftime("%Y-%m-%d")
-    return parser.parse(f"{date_string}T00:00:00Z")
+    return datetime(datetime_in.year, datetime_in.month, datetime_in.day, 0, 0, 0, tzinfo=timezone.utc)
 
 
 def latest_datetime(date_in: Union[date, str]) -> datetime:
@@ -49,8 +50,7 @@ def latest_datetime(date_in: Union[date, str]) -> datetime:
     else:
         datetime_in = date_in
 
-    date_string = datetime_in.strftime("%Y-%m-%d")
-    return parser.parse(f"{date_string}T23:59:59Z")
+    return datetime(datetime_in.year, datetime_in.month, datetime_in.day, 23, 59, 59, tzinfo=timezone.utc)
 
 def search_granules(
         concept_ID: str,
@@ -112,11 +112,13 @@ def search_granules(
         # If the target geometry is a Polygon, add a polygon constraint to the query
         ring = geometry.exterior
         
+        coordinates = shapely.get_coordinates(ring)
+
         # Ensure the ring is counter-clockwise
-        if not ring.is_ccw:
-            ring = ring.reverse()
+        if not shapely.is_ccw(ring):
+            coordinates = coordinates[::-1]
         
-        coordinates = ring.coords
+        coordinates = coordinates.tolist()
         
         # Add the polygon coordinates to the query
         query = query.polygon(coordinates)
@@ -125,11 +127,13 @@ def search_granules(
         # If the target geometry is a RasterGeometry, add a polygon constraint to the query
         ring = geometry.corner_polygon_latlon.exterior
         
+        coordinates = shapely.get_coordinates(ring)
+
         # Ensure the ring is counter-clockwise
-        if not ring.is_ccw:
-            ring = ring.reverse()
+        if not shapely.is_ccw(ring):
+            coordinates = coordinates[::-1]
         
-        coordinates = ring.coords
+        coordinates = coordinates.tolist()
         
         # Add the polygon coordinates to the query
         query = query.polygon(coordinates)
@@ -145,13 +149,24 @@ def search_granules(
     except Exception as e:
         raise CMRServerUnreachable(e)
     
+    # Collect the beginning datetime and native ID of each granule in one pass
+    begin_times = []
+    native_IDs = []
+
+    for granule in granules:
+        begin_times.append(granule["umm"]["TemporalExtent"]["RangeDateTime"]["BeginningDateTime"])
+        native_IDs.append(granule["meta"]["native-id"])
+
     # Sort the granules by their beginning datetime
-    granules = sorted(granules, key=lambda granule: granule["umm"]["TemporalExtent"]["RangeDateTime"]["BeginningDateTime"])
+    indices = np.argsort(np.array(begin_times, dtype=str), kind="stable")
+    granules = [granules[i] for i in indices]
 
     # Log the found granules
     logger.info("Found the following granules for VIIRS 2 using the CMR search:")
-    for granule in granules:
-        logger.info("  " + cl.file(granule["meta"]["native-id"]))
+
+    if len(granules) > 0:
+        logger.info("\n".join("  " + cl.file(native_IDs[i]) for i in indices))
+
     logger.info(f"Number of VIIRS 2 granules found using CMR search: {len(granules)}")
 
     return granules
\ No newline at end of file
@@ -0,0 +1,137 @@
+import h5py
+import numpy as np
+import pytest
+
+from modland import generate_modland_grid
+from rasters import Point, RasterGrid
+
+from VIIRS_tiled_granules import HDF5_MAX_OPEN_DATASETS, VIIRSTiledGranule
+from VIIRS_tiled_granules import VIIRS_tiled_granule
+
+GRID = "VNP_Grid_1km_2D"
+VARIABLE = "SurfReflect_M1"
+
+@pytest.fixture
+def granule(tmp_path):
+    filename = str(tmp_path / "VNP09GA.A2023001.h08v08.002.2023003120000.h5")
+    rng = np.random.default_rng(0)
+
+    with h5py.File(filename, "w") as file:
+        data_fields = file.create_group(f"HDFEOS/GRIDS/{GRID}/Data Fields")
+        dataset = data_fields.create_dataset(
+            VARIABLE,
+            data=rng.integers(0, 16000, size=(1200, 1200)).astype(np.int16),
+            chunks=(100, 100)
+        )
+        dataset.attrs["scale_factor"] = 0.0001
+
+    return VIIRSTiledGranule(filename)
+
+def test_layer_window_covers_cross_equator_latlon_target(granule):
+    # the sinusoidal extent of this target is widest at the equator, between its corners
+    geometry = RasterGrid.from_bbox((-96, -10, -92, 10), cell_size=0.01, crs="EPSG:4326")
+    expected = granule.layer(VARIABLE, GRID).to_geometry(geometry).array
+    layer = granule.layer(VARIABLE, GRID, geometry=geometry).array
+
+    # compare the pixels covered by the tile, which ends at the equator
+    covered = ~np.isnan(expected)
+    assert covered.any()
+    np.testing.assert_array_equal(layer[covered], expected[covered])
+
+def test_layer_window_reads_subset_for_sinusoidal_target(granule):
+    geometry = generate_modland_grid(tile="h08v08", tile_size=1200)[300:420, 515:700]
+    expected = granule.layer(VARIABLE, GRID).to_geometry(geometry)
+    layer = granule.layer(VARIABLE, GRID, geometry=geometry)
+
+    np.testing.assert_array_equal(layer.array, expected.array)
+
+def test_layer_samples_point_target(granule):
+    DN = granule.DN(VARIABLE, GRID, geometry=Point(-98, 4))
+    layer = granule.layer(VARIABLE, GRID, geometry=Point(-98, 4))
+
+    assert np.ndim(layer) == 0
+    assert layer == pytest.approx(DN * 0.0001)
+
+def test_attributes_returns_independent_copy(granule):
+    expected = granule.layer(VARIABLE, GRID).array
+    granule.attributes(VARIABLE, GRID)["scale_factor"] = 1.0
+
+    assert granule.attributes(VARIABLE, GRID)["scale_factor"] == 0.0001
+    np.testing.assert_array_equal(granule.layer(VARIABLE, GRID).array, expected)
+
+def open_files() -> int:
+    return h5py.h5f.get_obj_count(h5py.h5f.OBJ_ALL, h5py.h5f.OBJ_FILE)
+
+def test_file_is_only_held_open_inside_with_block(granule):
+    granule.DN(VARIABLE, GRID)
+    assert open_files() == 0
+
+    with granule:
+        granule.DN(VARIABLE, GRID)
+        granule.attributes(VARIABLE, GRID)
+        assert open_files() == 1
+
+    assert open_files() == 0
+
+def test_with_block_keeps_only_recent_datasets_open(tmp_path):
+    filename = str(tmp_path / "VNP09GA.A2023001.h08v08.002.2023003120000.h5")
+
+    with h5py.File(filename, "w") as file:
+        data_fields = file.create_group(f"HDFEOS/GRIDS/{GRID}/Data Fields")
+
+        for index in range(HDF5_MAX_OPEN_DATASETS + 2):
+            data_fields.create_dataset(f"variable_{index}", data=np.zeros((120, 120), dtype=np.int16))
+
+    with VIIRSTiledGranule(filename) as granule:
+        for index in range(HDF5_MAX_OPEN_DATASETS + 2):
+            granule.DN(f"variable_{index}", GRID)
+
+        assert h5py.h5f.get_obj_count(h5py.h5f.OBJ_ALL, h5py.h5f.OBJ_DATASET) == HDF5_MAX_OPEN_DATASETS
+
+# fill value, valid range, scale factor and offset for each DN type
+LAYER_ATTRIBUTES = {
+    np.int16: (-28672, (-100, 16000), 0.0001, 0.0),
+    np.uint16: (65535, (10, 60000), 0.00002, -0.1),
+    np.uint8: (255, (1, 250), 0.004, -0.5)
+}
+
+@pytest.fixture(params=list(LAYER_ATTRIBUTES), ids=lambda dtype: dtype.__name__)
+def layer_case(tmp_path, request):
+    dtype = request.param
+    fill, valid_range, scale, offset = LAYER_ATTRIBUTES[dtype]
+    info = np.iinfo(dtype)
+    rng = np.random.default_rng(0)
+    DN = rng.integers(info.min, info.max, size=(120, 120), endpoint=True).astype(dtype)
+    DN[0, :10] = fill
+    DN[1, :10] = valid_range[0]
+    DN[2, :10] = valid_range[1]
+
+    filename = str(tmp_path / "VNP09GA.A2023001.h08v08.002.2023003120000.h5")
+
+    with h5py.File(filename, "w") as file:
+        data_fields = file.create_group(f"HDFEOS/GRIDS/{GRID}/Data Fields")
+        dataset = data_fields.create_dataset(VARIABLE, data=DN, chunks=(60, 60))
+        dataset.attrs["_Fillvalue"] = np.array(fill, dtype=dtype)
+        dataset.attrs["valid_range"] = np.array(valid_range, dtype=dtype)
+        dataset.attrs["scale_factor"] = scale
+        dataset.attrs["add_offset"] = offset
+
+    invalid = (DN == fill) | (DN < valid_range[0]) | (DN > valid_range[1])
+    expected = np.where(invalid, np.nan, DN.astype(np.float64) * scale + offset)
+
+    return VIIRSTiledGranule(filename), expected
+
+@pytest.mark.parametrize("kernel", ["numexpr", "numpy"])
+def test_layer_masks_fill_and_valid_range_and_applies_scale_and_offset(layer_case, kernel, monkeypatch):
+    if kernel == "numexpr":
+        pytest.importorskip("numexpr")
+    else:
+        monkeypatch.setattr(VIIRS_tiled_granule, "ne", None)
+
+    granule, expected = layer_case
+    layer = granule.layer(VARIABLE, GRID)
+
+    assert layer.dtype == np.float32
+    np.testing.assert_array_equal(np.isnan(layer.array), np.isnan(expected))
+    np.testing.assert_allclose(layer.array, expected, rtol=1e-6, atol=1e-6, equal_nan=True)
+    np.testing.assert_allclose(granule.layer(VARIABLE, GRID, dtype=np.float64).array, expected, equal_nan=True)
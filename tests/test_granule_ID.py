@@ -0,0 +1,34 @@
+from datetime import date
+
+import pytest
+
+from VIIRS_tiled_granules import (
+    VIIRSTiledGranule,
+    parse_VIIRS_build,
+    parse_VIIRS_date,
+    parse_VIIRS_filename,
+    parse_VIIRS_product,
+    parse_VIIRS_tile
+)
+
+def test_parse_VIIRS_filename():
+    components = parse_VIIRS_filename("/data/VNP09GA.A2024366.h08v05.002.2025002120000.h5")
+
+    assert components.product == "VNP09GA"
+    assert components.date == date(2024, 12, 31)
+    assert components.tile == "h08v05"
+    assert components.build == 2
+
+def test_single_field_parsers_only_need_their_field():
+    assert parse_VIIRS_product("VNP09GA.A2023001.h08v05") == "VNP09GA"
+    assert parse_VIIRS_tile("VNP09GA.A2023001.h08v05") == "h08v05"
+    assert parse_VIIRS_tile("VNP09GA.A2023001.h08v05.X.h5") == "h08v05"
+    assert VIIRSTiledGranule("VNP09GA.A2023001.h08v05.X.h5").hv == (8, 5)
+
+    with pytest.raises(ValueError):
+        parse_VIIRS_build("VNP09GA.A2023001.h08v05.X.h5")
+
+@pytest.mark.parametrize("date_token", ["A2023000", "A2023366", "A2023400", "A20230x1", "A202301"])
+def test_parse_VIIRS_date_rejects_invalid_tokens(date_token):
+    with pytest.raises(ValueError):
+        parse_VIIRS_date(f"VNP09GA.{date_token}.h08v05.002.h5")